@@ -0,0 +1,31 @@
+#! /usr/bin/env python3
+#
+# share a monome 128 between two independent programs: each half of the grid
+# gets its own serialosc-style endpoint that any osc client can connect to
+
+import asyncio
+import monome
+
+class BrokerSerialOsc(monome.SerialOsc):
+    def __init__(self, broker, loop=None, autoconnect_app=None):
+        super().__init__(loop, autoconnect_app)
+        self.broker = broker
+
+    async def broker_connect(self, port):
+        transport, grid = await self.loop.create_datagram_endpoint(monome.Grid, local_addr=('127.0.0.1', 0), remote_addr=('127.0.0.1', port))
+
+        left = await self.broker.add_client((8, 8), (0, 0))
+        right = await self.broker.add_client((8, 8), (8, 0))
+        print('left half on port {}, right half on port {}'.format(left.port, right.port))
+
+        self.broker.attach(grid)
+
+    def on_device_added(self, id, type, port):
+        if type == "monome 128":
+            asyncio.ensure_future(self.broker_connect(port))
+
+if __name__ == "__main__":
+    loop = asyncio.get_event_loop()
+    broker = monome.GridBroker(loop=loop)
+    asyncio.ensure_future(BrokerSerialOsc.create(loop=loop, broker=broker))
+    loop.run_forever()
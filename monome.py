@@ -22,17 +22,330 @@
 
 import asyncio
 import aiosc
+import functools
+import heapq
 import itertools
+import mmap
+import queue
 import re
+import struct
+import threading
+import time
 
 
 DISCONNECTED, CONNECTING, READY = range(3)
+RECORD_IN, RECORD_OUT = range(2)
+
+LOG_MAGIC = b'PMSL\x01\x00\x00\x00'
+LOG_RECORD = struct.Struct('<dBH')
 
 def pack_row(row):
     return row[7] << 7 | row[6] << 6 | row[5] << 5 | row[4] << 4 | row[3] << 3 | row[2] << 2 | row[1] << 1 | row[0]
 
+def unpack_row(value):
+    return [value >> i & 1 for i in range(8)]
+
+def make_level_table(gamma=1.0, brightness=1.0):
+    return [int(round(15 * (l / 15) ** gamma * brightness)) for l in range(16)]
+
+
+def orient_point(x, y, width, height, rotation, mirror_x, mirror_y):
+    # map a logical point to device coordinates, rotating clockwise
+    if mirror_x:
+        x = width - 1 - x
+    if mirror_y:
+        y = height - 1 - y
+
+    if rotation == 90:
+        return height - 1 - y, x
+    elif rotation == 180:
+        return width - 1 - x, height - 1 - y
+    elif rotation == 270:
+        return y, width - 1 - x
+    return x, y
+
+
+class Orientation:
+    def __init__(self, device_width, device_height, rotation=0, mirror_x=False, mirror_y=False):
+        self.rotation = rotation % 360
+        if self.rotation not in (0, 90, 180, 270):
+            raise ValueError('rotation must be a multiple of 90 degrees')
+        self.mirror_x = mirror_x
+        self.mirror_y = mirror_y
+
+        self.device_width = device_width
+        self.device_height = device_height
+        if self.rotation in (90, 270):
+            self.width, self.height = device_height, device_width
+        else:
+            self.width, self.height = device_width, device_height
+
+        args = self.args()
+
+        # logical -> device points, device -> logical keys
+        self.points = [[orient_point(x, y, self.width, self.height, *args)
+            for x in range(self.width)] for y in range(self.height)]
+        self.keys = [[None] * device_width for row in range(device_height)]
+        for y, row in enumerate(self.points):
+            for x, (dx, dy) in enumerate(row):
+                self.keys[dy][dx] = (x, y)
+
+        # flat device index -> flat logical index, for whole frames
+        self.permutation = [x + y * self.width for row in self.keys for x, y in row]
+
+        # device cell -> logical cell within an 8x8 quad
+        quad_points = {orient_point(x, y, 8, 8, *args): (x, y) for x in range(8) for y in range(8)}
+        self.quad = [[quad_points[(x, y)] for x in range(8)] for y in range(8)]
+
+    def point(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.points[y][x]
+        return None
+
+    def key(self, x, y):
+        if 0 <= x < self.device_width and 0 <= y < self.device_height:
+            return self.keys[y][x]
+        return None
+
+    def map(self, x_offset, y_offset, data):
+        args = self.args()
+        x0, y0 = orient_point(x_offset, y_offset, self.width, self.height, *args)
+        x1, y1 = orient_point(x_offset + 7, y_offset + 7, self.width, self.height, *args)
+        return min(x0, x1), min(y0, y1), [[data[y][x] for x, y in row] for row in self.quad]
+
+    def line(self, kind, x, y, data):
+        if not (0 <= x < self.width and 0 <= y < self.height):
+            return None
+        if kind == 'row':
+            data = data[:self.width - x]
+            if not data:
+                return None
+            first, last = self.points[y][x], self.points[y][x + len(data) - 1]
+        else:
+            data = data[:self.height - y]
+            if not data:
+                return None
+            first, last = self.points[y][x], self.points[y + len(data) - 1][x]
+
+        if first[1] == last[1]:
+            return 'row', min(first[0], last[0]), first[1], data[::-1] if first[0] > last[0] else data
+        return 'col', first[0], min(first[1], last[1]), data[::-1] if first[1] > last[1] else data
+
+    def args(self):
+        return self.rotation, self.mirror_x, self.mirror_y
+
+
+class KeyState:
+    __slots__ = (
+        'double_tap_time', 'long_press_time', 'chord_time', 'loop', 'rows', 'count', 'pressed',
+        'last_press', 'long_press_handles', 'chord_start', 'chord_peak', 'chord_rows'
+    )
+
+    def __init__(self, double_tap_time=0.3, long_press_time=0.5, chord_time=0.1, loop=None):
+        self.double_tap_time = double_tap_time
+        self.long_press_time = long_press_time
+        self.chord_time = chord_time
+        self.loop = loop
+
+        # one bitset per row, bit x set while key (x, y) is held
+        self.rows = []
+        self.count = 0
+        self.pressed = {}
+        self.last_press = {}
+        self.long_press_handles = {}
+
+        self.chord_start = None
+        self.chord_peak = 0
+        self.chord_rows = None
+
+    def update(self, x, y, s, handler=None, now=None):
+        if now is None:
+            now = time.monotonic()
+        while y >= len(self.rows):
+            self.rows.append(0)
+
+        bit = 1 << x
+        if s:
+            if self.rows[y] & bit:
+                return
+            self.rows[y] |= bit
+            self.count += 1
+            self.pressed[(x, y)] = now
+            self.__press_gestures(x, y, handler, now)
+        else:
+            if not self.rows[y] & bit:
+                return
+            self.rows[y] &= ~bit
+            self.count -= 1
+            del self.pressed[(x, y)]
+            self.__release_gestures(x, y, handler)
+
+    def __press_gestures(self, x, y, handler, now):
+        if self.count == 1:
+            self.chord_start = now
+            self.chord_peak = 0
+        if self.count > self.chord_peak and now - self.chord_start <= self.chord_time:
+            self.chord_peak = self.count
+            self.chord_rows = list(self.rows)
+
+        last = self.last_press.get((x, y))
+        if last is not None and now - last <= self.double_tap_time:
+            self.last_press[(x, y)] = None
+            callback = getattr(handler, 'on_grid_double_tap', None)
+            if callback is not None:
+                callback(x, y)
+        else:
+            self.last_press[(x, y)] = now
+
+        callback = getattr(handler, 'on_grid_long_press', None)
+        if callback is not None:
+            loop = self.loop if self.loop is not None else asyncio.get_event_loop()
+            self.long_press_handles[(x, y)] = loop.call_later(self.long_press_time, self.__long_press, x, y, callback)
+
+    def __release_gestures(self, x, y, handler):
+        handle = self.long_press_handles.pop((x, y), None)
+        if handle is not None:
+            handle.cancel()
+
+        # report a chord once, on the first release after it peaked
+        if self.chord_peak >= 2:
+            callback = getattr(handler, 'on_grid_chord', None)
+            if callback is not None:
+                callback(list(self.__iter_rows(self.chord_rows)))
+        self.chord_peak = 0
+
+    def __long_press(self, x, y, callback):
+        del self.long_press_handles[(x, y)]
+        callback(x, y)
+
+    def __iter_rows(self, rows, x_mask=-1, y_range=None):
+        for y in y_range if y_range is not None else range(len(rows)):
+            row = rows[y] & x_mask
+            while row:
+                low = row & -row
+                yield low.bit_length() - 1, y
+                row ^= low
+
+    def is_held(self, x, y):
+        return y < len(self.rows) and bool(self.rows[y] >> x & 1)
+
+    def count_held(self):
+        return self.count
+
+    def held(self):
+        return list(self.__iter_rows(self.rows))
+
+    def held_in_rect(self, x, y, width, height):
+        mask = ((1 << width) - 1) << x
+        return list(self.__iter_rows(self.rows, mask, range(y, min(y + height, len(self.rows)))))
+
+    def count_in_rect(self, x, y, width, height):
+        mask = ((1 << width) - 1) << x
+        return sum(bin(row & mask).count('1') for row in self.rows[y:y + height])
+
+    def first_held_in_row(self, y, start=0):
+        if y >= len(self.rows):
+            return None
+        row = self.rows[y] >> start << start
+        if not row:
+            return None
+        return (row & -row).bit_length() - 1
+
+    def pressed_at(self, x, y):
+        return self.pressed.get((x, y))
+
+    def held_for(self, x, y, now=None):
+        pressed = self.pressed.get((x, y))
+        if pressed is None:
+            return None
+        return (time.monotonic() if now is None else now) - pressed
+
+
+class SessionRecorder:
+    # appends (time, direction, raw osc packet) records to a binary log
+    def __init__(self, path):
+        self.file = open(path, 'wb')
+        self.file.write(LOG_MAGIC)
+        self.start = time.monotonic()
+
+    def write(self, direction, data):
+        self.file.write(LOG_RECORD.pack(time.monotonic() - self.start, direction, len(data)))
+        self.file.write(data)
+
+    def close(self):
+        self.file.close()
+
+
+class SessionLog:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:len(LOG_MAGIC)] != LOG_MAGIC:
+            raise ValueError('{} is not a session log'.format(path))
+
+    def __iter__(self):
+        # packets are copied out as bytes, so records may outlive close()
+        offset = len(LOG_MAGIC)
+        while offset < len(self.data):
+            t, direction, size = LOG_RECORD.unpack_from(self.data, offset)
+            offset += LOG_RECORD.size
+            yield t, direction, self.data[offset:offset + size]
+            offset += size
+
+    def messages(self, direction=None):
+        for t, d, data in self:
+            if direction is not None and d != direction:
+                continue
+            if data.startswith(b'#bundle'):
+                for path, args in aiosc.parse_bundle(data):
+                    yield t, d, path, args
+            else:
+                path, args = aiosc.parse_message(data)
+                yield t, d, path, args
+
+    def volume(self, direction=RECORD_OUT):
+        # path -> [messages, bytes], for comparing output between releases
+        result = {}
+        for t, d, data in self:
+            if d == direction:
+                path = aiosc.read_string(data)[0]
+                entry = result.setdefault(path, [0, 0])
+                entry[0] += 1
+                entry[1] += len(data)
+        return result
+
+    def close(self):
+        self.data.close()
+
+
+class RecordableProtocol(aiosc.OSCProtocol):
+    def __init__(self, handlers=None):
+        self.recorder = None
+        super().__init__(handlers=handlers)
 
-class Grid(aiosc.OSCProtocol):
+    def datagram_received(self, data, addr):
+        if self.recorder is not None:
+            self.recorder.write(RECORD_IN, data)
+        super().datagram_received(data, addr)
+
+    def send(self, path, *args, addr=None):
+        if self.recorder is None:
+            return super().send(path, *args, addr=addr)
+        data = aiosc.pack_message(path, *args)
+        self.recorder.write(RECORD_OUT, data)
+        return self.transport.sendto(data, addr)
+
+    def send_bundle(self, messages, timetag=None, addr=None):
+        if self.recorder is None:
+            return super().send_bundle(messages, timetag=timetag, addr=addr)
+        data = aiosc.pack_bundle(messages, timetag=timetag)
+        self.recorder.write(RECORD_OUT, data)
+        return self.transport.sendto(data, addr)
+
+
+class Grid(RecordableProtocol):
+    # no __slots__ here: aiosc.OSCProtocol instances carry a __dict__ anyway,
+    # so HeadlessGrid is the compact path for large numbers of grids
     def __init__(self):
         self.prefix = 'monome'
         self.id = None
@@ -41,6 +354,15 @@ class Grid(aiosc.OSCProtocol):
         self.varibright = True
         self.state = DISCONNECTED
 
+        self.device_width = None
+        self.device_height = None
+        self.orientation = None
+        self.orientation_args = (0, False, False)
+        self.keys = KeyState()
+
+        self.level_table = None
+        self.mono_table = [l >> 3 & 1 for l in range(16)]
+
         super().__init__(handlers={
             '/sys/connect': lambda *args: self.__sys_connect(),
             '/sys/disconnect': lambda *args: self.__sys_disconnect(),
@@ -80,7 +402,8 @@ class Grid(aiosc.OSCProtocol):
         if path == '/sys/id':
             self.id = args[0]
         elif path == '/sys/size':
-            self.width, self.height = (args[0], args[1])
+            self.device_width, self.device_height = (args[0], args[1])
+            self.__apply_orientation()
         elif path == '/sys/rotation':
             self.rotation = args[0]
 
@@ -92,97 +415,384 @@ class Grid(aiosc.OSCProtocol):
 
             self.__ready()
 
+    def set_orientation(self, rotation=0, mirror_x=False, mirror_y=False):
+        self.orientation_args = (rotation, mirror_x, mirror_y)
+        if self.device_width is not None:
+            self.__apply_orientation()
+            Layout.invalidate()
+            # wrappers, pages and sections size themselves on ready, so let
+            # the whole tree pick up the new logical size
+            if self.state == READY:
+                self.__ready()
+
+    def __apply_orientation(self):
+        rotation, mirror_x, mirror_y = self.orientation_args
+        if rotation % 360 == 0 and not mirror_x and not mirror_y:
+            self.orientation = None
+            self.width, self.height = self.device_width, self.device_height
+        else:
+            self.orientation = Orientation(self.device_width, self.device_height, *self.orientation_args)
+            self.width, self.height = self.orientation.width, self.orientation.height
+
     def __ready(self):
         if self.event_handler is not None:
             self.event_handler.on_grid_ready()
 
     def __grid_key(self, addr, path, x, y, s):
         if self.event_handler is not None and path.startswith("/" + self.prefix):
+            if self.orientation is not None:
+                key = self.orientation.key(x, y)
+                if key is None:
+                    return
+                x, y = key
+            self.keys.update(x, y, s, self.event_handler)
             self.event_handler.on_grid_key(x, y, s)
 
     def __tilt(self, addr, path, n, x, y, z):
         if self.event_handler is not None and path.startswith("/" + self.prefix):
-            self.event_handler_on_tilt(n, x, y, z)
+            on_tilt = getattr(self.event_handler, 'on_tilt', None)
+            if on_tilt is not None:
+                on_tilt(n, x, y, z)
 
     def led_set(self, x, y, s):
+        if self.orientation is not None:
+            point = self.orientation.point(x, y)
+            if point is None:
+                return
+            x, y = point
         self.send('/{}/grid/led/set'.format(self.prefix), x, y, s)
 
     def led_all(self, s):
         self.send('/{}/grid/led/all'.format(self.prefix), s)
 
     def led_map(self, x_offset, y_offset, data):
-        args = [pack_row(data[i]) for i in range(8)]
-        self.send('/{}/grid/led/map'.format(self.prefix), x_offset, y_offset, *args)
+        if self.orientation is not None:
+            x_offset, y_offset, data = self.orientation.map(x_offset, y_offset, data)
+        self.__send_map(x_offset, y_offset, data)
 
     def led_row(self, x_offset, y, data):
-        args = [pack_row(data[i*8:(i+1)*8]) for i in range(len(data) // 8)]
-        self.send('/{}/grid/led/row'.format(self.prefix), x_offset, y, *args)
+        line = self.__orient_line('row', x_offset, y, data)
+        if line is not None:
+            self.__send_line(*line)
 
     def led_col(self, x, y_offset, data):
-        args = [pack_row(data[i*8:(i+1)*8]) for i in range(len(data) // 8)]
-        self.send('/{}/grid/led/col'.format(self.prefix), x, y_offset, *args)
+        line = self.__orient_line('col', x, y_offset, data)
+        if line is not None:
+            self.__send_line(*line)
 
     def led_intensity(self, i):
         self.send('/{}/grid/led/intensity'.format(self.prefix), i)
 
     def led_level_set(self, x, y, l):
-        if self.varibright:
-            self.send('/{}/grid/led/level/set'.format(self.prefix), x, y, l)
-        else:
-            self.led_set(x, y, l >> 3 & 1)
+        if self.orientation is not None:
+            point = self.orientation.point(x, y)
+            if point is None:
+                return
+            x, y = point
+        self.__send_level_set(x, y, l)
 
     def led_level_all(self, l):
         if self.varibright:
+            if self.level_table is not None:
+                l = self.level_table[l]
             self.send('/{}/grid/led/level/all'.format(self.prefix), l)
         else:
-            self.led_all(l >> 3 & 1)
+            self.led_all(self.mono_table[l])
 
     def led_level_map(self, x_offset, y_offset, data):
+        if self.orientation is not None:
+            x_offset, y_offset, data = self.orientation.map(x_offset, y_offset, data)
+        self.__send_level_map(x_offset, y_offset, data)
+
+    def led_level_row(self, x_offset, y, data):
+        line = self.__orient_line('row', x_offset, y, data)
+        if line is not None:
+            self.__send_level_line(*line)
+
+    def led_level_col(self, x, y_offset, data):
+        line = self.__orient_line('col', x, y_offset, data)
+        if line is not None:
+            self.__send_level_line(*line)
+
+    def render_frame(self, frame):
+        # frame is already in device orientation, see GridBuffer.oriented
+        for x_offset in range(0, frame.width, 8):
+            for y_offset in range(0, frame.height, 8):
+                self.__send_level_map(x_offset, y_offset, frame.get_level_map(x_offset, y_offset))
+
+    def __orient_line(self, kind, x, y, data):
+        if not data:
+            return None
+        if self.orientation is None:
+            return kind, x, y, data
+        return self.orientation.line(kind, x, y, data)
+
+    def __send_map(self, x_offset, y_offset, data):
+        args = [pack_row(data[i]) for i in range(8)]
+        self.send('/{}/grid/led/map'.format(self.prefix), x_offset, y_offset, *args)
+
+    def __send_line(self, kind, x, y, data):
+        args = [pack_row(data[i*8:(i+1)*8]) for i in range(len(data) // 8)]
+        self.send('/{}/grid/led/{}'.format(self.prefix, kind), x, y, *args)
+
+    def __send_level_set(self, x, y, l):
         if self.varibright:
-            args = itertools.chain(*data)
-            self.send('/{}/grid/led/level/map'.format(self.prefix), x_offset, y_offset, *args)
+            if self.level_table is not None:
+                l = self.level_table[l]
+            self.send('/{}/grid/led/level/set'.format(self.prefix), x, y, l)
         else:
-            self.led_map(x_offset, y_offset, [[l >> 3 & 1 for l in row] for row in data])
+            self.send('/{}/grid/led/set'.format(self.prefix), x, y, self.mono_table[l])
 
-    def led_level_row(self, x_offset, y, data):
+    def __send_level_map(self, x_offset, y_offset, data):
         if self.varibright:
-            self.send('/{}/grid/led/level/row'.format(self.prefix), x_offset, y, *data)
+            args = itertools.chain(*data)
+            if self.level_table is not None:
+                args = map(self.level_table.__getitem__, args)
+            self.send('/{}/grid/led/level/map'.format(self.prefix), x_offset, y_offset, *args)
         else:
-            self.led_row(x_offset, y, [l >> 3 & 1 for l in data])
+            table = self.mono_table
+            self.__send_map(x_offset, y_offset, [[table[l] for l in row] for row in data])
 
-    def led_level_col(self, x, y_offset, data):
+    def __send_level_line(self, kind, x, y, data):
         if self.varibright:
-            self.send('/{}/grid/led/level/col'.format(self.prefix), x, y_offset, *data)
+            if self.level_table is not None:
+                data = map(self.level_table.__getitem__, data)
+            self.send('/{}/grid/led/level/{}'.format(self.prefix, kind), x, y, *data)
         else:
-            self.led_col(x, y_offset, [l >> 3 & 1 for l in data])
+            table = self.mono_table
+            self.__send_line(kind, x, y, [table[l] for l in data])
+
+    def set_level_table(self, table=None, frame=None):
+        # table maps each of the 16 levels to what the device receives, None
+        # passes levels through; monobright grids threshold the mapped level.
+        # With the frame currently shown, only quads holding a level whose
+        # encoding changed are resent.
+        if table is not None:
+            table = list(table)
+            if len(table) != 16 or not all(0 <= l <= 15 for l in table):
+                raise ValueError('level table must hold 16 levels between 0 and 15')
+
+        old = self.__encoding()
+        self.level_table = table
+        self.mono_table = [(l if table is None else table[l]) >> 3 & 1 for l in range(16)]
+
+        if frame is not None:
+            changed = set(l for l, (a, b) in enumerate(zip(old, self.__encoding())) if a != b)
+            for x_offset in range(0, frame.width, 8):
+                for y_offset in range(0, frame.height, 8):
+                    quad = frame.get_level_map(x_offset, y_offset)
+                    if not changed.isdisjoint(itertools.chain(*quad)):
+                        self.led_level_map(x_offset, y_offset, quad)
+
+    def __encoding(self):
+        if not self.varibright:
+            return self.mono_table
+        return self.level_table if self.level_table is not None else list(range(16))
 
     def tilt_set(self, n, s):
         self.send('/{}/tilt/set'.format(self.prefix), n, s)
 
 
+class Layout:
+    # bumped whenever a wrapper tree changes shape (pages switched, sections
+    # attached, grids ready), so compiled routes and key tables get rebuilt
+    version = 0
+
+    @classmethod
+    def invalidate(cls):
+        cls.version += 1
+
+
+class Route:
+    # a leaf's wrapper chain compiled into (target, dx, dy, x0, y0, x1, y1)
+    # tuples: leaf coordinates are shifted by dx, dy and clipped to
+    # x0 <= x < x1, y0 <= y < y1 in the target's own coordinates
+    __slots__ = ('targets', 'version')
+
+    def __init__(self, targets):
+        self.targets = targets
+        self.version = Layout.version
+
+    @classmethod
+    def of(cls, node):
+        if hasattr(node, 'route'):
+            return node.route()
+        return cls([(node, 0, 0, 0, 0, node.width, node.height)])
+
+    def translate(self, x_offset, y_offset, width, height):
+        targets = []
+        for target, dx, dy, x0, y0, x1, y1 in self.targets:
+            dx, dy = dx + x_offset, dy + y_offset
+            clip = (max(x0, dx), max(y0, dy), min(x1, dx + width), min(y1, dy + height))
+            if clip[0] < clip[2] and clip[1] < clip[3]:
+                targets.append((target, dx, dy) + clip)
+        return Route(targets)
+
+    def __point(self, method, x, y, value):
+        for target, dx, dy, x0, y0, x1, y1 in self.targets:
+            if x0 <= x + dx < x1 and y0 <= y + dy < y1:
+                getattr(target, method)(x + dx, y + dy, value)
+
+    @staticmethod
+    def __whole(target, start, end):
+        # devices pack rows and columns 8 cells to a byte, so a shorter line
+        # would light nothing; buffers take lines of any length
+        return isinstance(target, GridBuffer) or not (end - start) & 7
+
+    def __all(self, method, map_method, row_method, point_method, value):
+        for target, dx, dy, x0, y0, x1, y1 in self.targets:
+            if (x0, y0, x1, y1) == (0, 0, target.width, target.height):
+                getattr(target, method)(value)
+            elif not (x0 | y0 | x1 | y1) & 7:
+                data = [[value] * 8 for row in range(8)]
+                for y in range(y0, y1, 8):
+                    for x in range(x0, x1, 8):
+                        getattr(target, map_method)(x, y, data)
+            elif self.__whole(target, x0, x1):
+                for y in range(y0, y1):
+                    getattr(target, row_method)(x0, y, [value] * (x1 - x0))
+            else:
+                point = getattr(target, point_method)
+                for y in range(y0, y1):
+                    for x in range(x0, x1):
+                        point(x, y, value)
+
+    def __map(self, method, x_offset, y_offset, data):
+        for target, dx, dy, x0, y0, x1, y1 in self.targets:
+            x, y = x_offset + dx, y_offset + dy
+            if x < x1 and x + 8 > x0 and y < y1 and y + 8 > y0:
+                getattr(target, method)(x, y, data)
+
+    def __row(self, method, point_method, x_offset, y, data):
+        for target, dx, dy, x0, y0, x1, y1 in self.targets:
+            x, row = x_offset + dx, y + dy
+            start, end = max(x, x0), min(x + len(data), x1)
+            if y0 <= row < y1 and start < end:
+                if self.__whole(target, start, end):
+                    getattr(target, method)(start, row, data[start - x:end - x])
+                else:
+                    point = getattr(target, point_method)
+                    for col in range(start, end):
+                        point(col, row, data[col - x])
+
+    def __col(self, method, point_method, x, y_offset, data):
+        for target, dx, dy, x0, y0, x1, y1 in self.targets:
+            col, y = x + dx, y_offset + dy
+            start, end = max(y, y0), min(y + len(data), y1)
+            if x0 <= col < x1 and start < end:
+                if self.__whole(target, start, end):
+                    getattr(target, method)(col, start, data[start - y:end - y])
+                else:
+                    point = getattr(target, point_method)
+                    for row in range(start, end):
+                        point(col, row, data[row - y])
+
+    def led_set(self, x, y, s):
+        self.__point('led_set', x, y, s)
+
+    def led_all(self, s):
+        self.__all('led_all', 'led_map', 'led_row', 'led_set', s)
+
+    def led_map(self, x_offset, y_offset, data):
+        self.__map('led_map', x_offset, y_offset, data)
+
+    def led_row(self, x_offset, y, data):
+        self.__row('led_row', 'led_set', x_offset, y, data)
+
+    def led_col(self, x, y_offset, data):
+        self.__col('led_col', 'led_set', x, y_offset, data)
+
+    def led_intensity(self, i):
+        for target, *clip in self.targets:
+            if not isinstance(target, GridBuffer):
+                target.led_intensity(i)
+
+    def led_level_set(self, x, y, l):
+        self.__point('led_level_set', x, y, l)
+
+    def led_level_all(self, l):
+        self.__all('led_level_all', 'led_level_map', 'led_level_row', 'led_level_set', l)
+
+    def led_level_map(self, x_offset, y_offset, data):
+        self.__map('led_level_map', x_offset, y_offset, data)
+
+    def led_level_row(self, x_offset, y, data):
+        self.__row('led_level_row', 'led_level_set', x_offset, y, data)
+
+    def led_level_col(self, x, y_offset, data):
+        self.__col('led_level_col', 'led_level_set', x, y_offset, data)
+
+
+def resolve_key(node, x, y):
+    # follow a key event down through nodes that only forward it, so the
+    # whole chain can be replaced by a single call to the final handler;
+    # the key states those nodes would have updated are collected, each
+    # with the key in that node's own coordinates
+    states = []
+    while node is not None:
+        handler = getattr(type(node), 'on_grid_key', None)
+        if handler is GridSection.on_grid_key or handler is Page.on_grid_key:
+            states.append((node.keys, x, y))
+            node = node.event_handler
+        elif handler is GridWrapper.on_grid_key:
+            states.append((node.keys, x, y))
+            node, x, y = node.key_target(x, y)
+        else:
+            return node, x, y, states
+    return None, x, y, states
+
+
 class GridWrapper:
+    __slots__ = ('grid', 'event_handler', 'prefix', 'keys', 'width', 'height', '__key_table')
+
     def __init__(self, grid):
         self.grid = grid
         self.grid.event_handler = self
         self.event_handler = None
+        self.keys = KeyState()
+        self.__key_table = None
+        Layout.invalidate()
 
     def connect(self):
         if self.grid.state == DISCONNECTED:
             self.grid.connect()
-        elif self.grid.state == CONNECTED:
+        elif self.grid.state == READY:
             self.on_grid_ready()
 
     def on_grid_ready(self):
         self.width = self.grid.width
         self.height = self.grid.height
+        Layout.invalidate()
         self.event_handler.on_grid_ready()
 
     def on_grid_key(self, x, y, s):
-        self.event_handler.on_grid_key(x, y, s)
+        if self.__key_table is None or self.__key_table[0] != Layout.version:
+            self.__key_table = (Layout.version, [[self.__resolve_key(col, row)
+                for col in range(self.grid.width)] for row in range(self.grid.height)])
+
+        # every node on the way tracks the key, but only the one right above
+        # the handler reports gestures, in the handler's own coordinates
+        handler, x, y, states = self.__key_table[1][y][x]
+        for keys, key_x, key_y in states[:-1]:
+            keys.update(key_x, key_y, s)
+        keys, key_x, key_y = states[-1]
+        keys.update(key_x, key_y, s, handler)
+        if handler is not None:
+            handler.on_grid_key(x, y, s)
+
+    def __resolve_key(self, x, y):
+        handler, target_x, target_y, states = resolve_key(*self.key_target(x, y))
+        return handler, target_x, target_y, [(self.keys, x, y)] + states
 
     def on_grid_disconnect(self):
         self.event_handler.on_grid_disconnect()
 
+    def key_target(self, x, y):
+        return self.event_handler, x, y
+
+    def route(self):
+        return Route.of(self.grid)
+
     def led_set(self, x, y, s):
         self.grid.led_set(x, y, s)
 
@@ -228,23 +838,17 @@ class GridBuffer:
 
     def __and__(self, other):
         result = GridBuffer(self.width, self.height)
-        for row in range(self.height):
-            for col in range(self.width):
-                result.levels[row][col] = self.levels[row][col] & other.levels[row][col]
+        result.levels = [[a & b for a, b in zip(row, other_row)] for row, other_row in zip(self.levels, other.levels)]
         return result
 
     def __xor__(self, other):
         result = GridBuffer(self.width, self.height)
-        for row in range(self.height):
-            for col in range(self.width):
-                result.levels[row][col] = self.levels[row][col] ^ other.levels[row][col]
+        result.levels = [[a ^ b for a, b in zip(row, other_row)] for row, other_row in zip(self.levels, other.levels)]
         return result
 
     def __or__(self, other):
         result = GridBuffer(self.width, self.height)
-        for row in range(self.height):
-            for col in range(self.width):
-                result.levels[row][col] = self.levels[row][col] | other.levels[row][col]
+        result.levels = [[a | b for a, b in zip(row, other_row)] for row, other_row in zip(self.levels, other.levels)]
         return result
 
     def led_set(self, x, y, s):
@@ -288,6 +892,30 @@ class GridBuffer:
             for y, l in enumerate(data[:self.height - y_offset]):
                 self.levels[y + y_offset][x] = l
 
+    def blit(self, sprite, x=0, y=0, src_x=0, src_y=0, width=None, height=None, transparent=True):
+        width = sprite.width - src_x if width is None else width
+        height = sprite.height - src_y if height is None else height
+
+        # clip the source window against both the sprite and the buffer
+        if x < 0:
+            src_x, width, x = src_x - x, width + x, 0
+        if y < 0:
+            src_y, height, y = src_y - y, height + y, 0
+        width = min(width, self.width - x, sprite.width - src_x)
+        height = min(height, self.height - y, sprite.height - src_y)
+
+        for r in range(max(height, 0)):
+            row = sprite.levels[src_y + r][src_x:src_x + width]
+            if transparent and not sprite.opaque[src_y + r]:
+                row = [s if s else d for s, d in zip(row, self.levels[y + r][x:x + width])]
+            if row:
+                self.led_level_row(x, y + r, row)
+
+    def copy(self):
+        result = GridBuffer(self.width, self.height)
+        result.levels = [list(row) for row in self.levels]
+        return result
+
     def get_level_map(self, x_offset, y_offset):
         map = []
         for y in range(y_offset, y_offset + 8):
@@ -302,16 +930,258 @@ class GridBuffer:
             map.append(row)
         return map
 
-    def render(self, grid):
+    def oriented(self, orientation):
+        levels = list(itertools.chain(*self.levels))
+        levels = [levels[i] for i in orientation.permutation]
+
+        frame = GridBuffer(orientation.device_width, orientation.device_height)
+        frame.levels = [levels[y * frame.width:(y + 1) * frame.width] for y in range(frame.height)]
+        return frame
+
+    def render(self, grid, previous=None):
+        orientation = getattr(grid, 'orientation', None)
+        if previous is None and orientation is not None and \
+                (self.width, self.height) == (orientation.width, orientation.height):
+            # rotate the whole frame with one permutation instead of quad by quad
+            grid.render_frame(self.oriented(orientation))
+            return
+
         for x_offset in [i * 8 for i in range(self.width // 8)]:
             for y_offset in [i * 8 for i in range(self.height // 8)]:
-                grid.led_level_map(x_offset, y_offset, self.get_level_map(x_offset, y_offset))
+                if previous is None:
+                    grid.led_level_map(x_offset, y_offset, self.get_level_map(x_offset, y_offset))
+                else:
+                    self.__render_quad_diff(grid, previous, x_offset, y_offset)
+
+    def __render_quad_diff(self, grid, previous, x_offset, y_offset):
+        # send only the quads that differ from what previous holds and bring
+        # previous up to date, so it keeps mirroring the device
+        changed = []
+        for y in range(y_offset, y_offset + 8):
+            row, prev_row = self.levels[y], previous.levels[y]
+            if row[x_offset:x_offset + 8] != prev_row[x_offset:x_offset + 8]:
+                changed.extend((x, y) for x in range(x_offset, x_offset + 8) if row[x] != prev_row[x])
+                prev_row[x_offset:x_offset + 8] = row[x_offset:x_offset + 8]
+
+        if len(changed) == 1:
+            x, y = changed[0]
+            grid.led_level_set(x, y, self.levels[y][x])
+        elif changed:
+            grid.led_level_map(x_offset, y_offset, self.get_level_map(x_offset, y_offset))
+
+
+BLEND_MODES = {
+    'over': lambda below, above: above if above else below,
+    'max': max,
+    'add': lambda below, above: min(below + above, 15),
+    'subtract': lambda below, above: max(below - above, 0),
+}
+
+
+class Layer(GridBuffer):
+    def __init__(self, width, height, blend='over', opacity=1.0, visible=True):
+        super().__init__(width, height)
+        self.dirty = None
+        self.__blend = blend
+        self.__opacity = opacity
+        self.__visible = visible
+        self.__update_table()
+
+    @property
+    def blend(self):
+        return self.__blend
+
+    @blend.setter
+    def blend(self, blend):
+        self.__blend = blend
+        self.__update_table()
+
+    @property
+    def opacity(self):
+        return self.__opacity
+
+    @opacity.setter
+    def opacity(self, opacity):
+        self.__opacity = opacity
+        self.__update_table()
+
+    @property
+    def visible(self):
+        return self.__visible
+
+    @visible.setter
+    def visible(self, visible):
+        self.__visible = visible
+        self.mark_dirty(0, 0, self.width, self.height)
+
+    def __update_table(self):
+        # table[below][above] holds the blended level for every pair, so
+        # flattening is a lookup per cell whatever the mode and opacity
+        blend = BLEND_MODES[self.__blend]
+        opacity = self.__opacity
+        self.table = [[int(round(below + (blend(below, above) - below) * opacity)) for above in range(16)]
+            for below in range(16)]
+        self.mark_dirty(0, 0, self.width, self.height)
+
+    def mark_dirty(self, x0, y0, x1, y1):
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if self.dirty is None:
+            self.dirty = (x0, y0, x1, y1)
+        else:
+            d = self.dirty
+            self.dirty = (min(d[0], x0), min(d[1], y0), max(d[2], x1), max(d[3], y1))
+
+    def led_level_set(self, x, y, l):
+        self.mark_dirty(x, y, x + 1, y + 1)
+        super().led_level_set(x, y, l)
+
+    def led_level_all(self, l):
+        self.mark_dirty(0, 0, self.width, self.height)
+        super().led_level_all(l)
+
+    def led_level_row(self, x_offset, y, data):
+        self.mark_dirty(x_offset, y, x_offset + len(data), y + 1)
+        super().led_level_row(x_offset, y, data)
+
+    def led_level_col(self, x, y_offset, data):
+        self.mark_dirty(x, y_offset, x + 1, y_offset + len(data))
+        super().led_level_col(x, y_offset, data)
+
+
+class LayerStack:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.layers = []
+        self.result = GridBuffer(width, height)
+        self.dirty = [(0, 0, width, height)]
+
+    def add_layer(self, blend='over', opacity=1.0, visible=True, index=None):
+        layer = Layer(self.width, self.height, blend, opacity, visible)
+        if index is None:
+            self.layers.append(layer)
+        else:
+            self.layers.insert(index, layer)
+        return layer
+
+    def remove_layer(self, layer):
+        self.layers.remove(layer)
+        self.dirty.append((0, 0, self.width, self.height))
+
+    def move_layer(self, layer, index):
+        self.layers.remove(layer)
+        self.layers.insert(index, layer)
+        self.dirty.append((0, 0, self.width, self.height))
+
+    def flatten(self):
+        rects = self.dirty
+        for layer in self.layers:
+            if layer.dirty is not None:
+                rects.append(layer.dirty)
+                layer.dirty = None
+        self.dirty = []
+
+        layers = [layer for layer in self.layers if layer.visible]
+        for x0, y0, x1, y1 in rects:
+            for y in range(y0, y1):
+                row = [0] * (x1 - x0)
+                for layer in layers:
+                    table = layer.table
+                    row = [table[below][above] for below, above in zip(row, layer.levels[y][x0:x1])]
+                self.result.levels[y][x0:x1] = row
+        return self.result
+
+    def render(self, grid, previous=None):
+        self.flatten().render(grid, previous)
+
+
+# 3x5 glyphs packed as one bitmask per column, bit 0 at the top
+FONT_HEIGHT = 5
+FONT = {
+    '0': (0x1f, 0x11, 0x1f), '1': (0x12, 0x1f, 0x10), '2': (0x1d, 0x15, 0x17),
+    '3': (0x11, 0x15, 0x1f), '4': (0x07, 0x04, 0x1f), '5': (0x17, 0x15, 0x1d),
+    '6': (0x1f, 0x15, 0x1d), '7': (0x01, 0x01, 0x1f), '8': (0x1f, 0x15, 0x1f),
+    '9': (0x17, 0x15, 0x1f), 'A': (0x1e, 0x05, 0x1e), 'B': (0x1f, 0x15, 0x0a),
+    'C': (0x0e, 0x11, 0x11), 'D': (0x1f, 0x11, 0x0e), 'E': (0x1f, 0x15, 0x11),
+    'F': (0x1f, 0x05, 0x01), 'G': (0x0e, 0x11, 0x1d), 'H': (0x1f, 0x04, 0x1f),
+    'I': (0x11, 0x1f, 0x11), 'J': (0x08, 0x10, 0x0f), 'K': (0x1f, 0x04, 0x1b),
+    'L': (0x1f, 0x10, 0x10), 'M': (0x1f, 0x06, 0x1f), 'N': (0x1f, 0x01, 0x1e),
+    'O': (0x0e, 0x11, 0x0e), 'P': (0x1f, 0x05, 0x02), 'Q': (0x0e, 0x19, 0x16),
+    'R': (0x1f, 0x05, 0x1a), 'S': (0x12, 0x15, 0x09), 'T': (0x01, 0x1f, 0x01),
+    'U': (0x1f, 0x10, 0x1f), 'V': (0x0f, 0x10, 0x0f), 'W': (0x1f, 0x0c, 0x1f),
+    'X': (0x1b, 0x04, 0x1b), 'Y': (0x03, 0x1c, 0x03), 'Z': (0x19, 0x15, 0x13),
+    ' ': (0x00, 0x00, 0x00), '.': (0x00, 0x10, 0x00), ',': (0x10, 0x08, 0x00),
+    '!': (0x00, 0x17, 0x00), '?': (0x01, 0x15, 0x02), '-': (0x04, 0x04, 0x04),
+    '+': (0x04, 0x0e, 0x04), ':': (0x00, 0x0a, 0x00), '/': (0x18, 0x04, 0x03),
+    "'": (0x00, 0x03, 0x00), '=': (0x0a, 0x0a, 0x0a),
+}
+
+
+class Sprite:
+    def __init__(self, levels):
+        self.levels = [list(row) for row in levels]
+        self.height = len(self.levels)
+        self.width = len(self.levels[0]) if self.levels else 0
+        # rows without transparent cells can be copied as one slice
+        self.opaque = [all(row) for row in self.levels]
+
+    @classmethod
+    def from_columns(cls, columns, height, level=15):
+        return cls([[level if column >> y & 1 else 0 for column in columns] for y in range(height)])
+
+
+@functools.lru_cache(maxsize=128)
+def render_text(text, level=15, spacing=1):
+    columns = []
+    for char in text.upper():
+        columns.extend(FONT.get(char, FONT['?']))
+        columns.extend([0] * spacing)
+    return Sprite.from_columns(columns[:len(columns) - spacing], FONT_HEIGHT, level)
+
+
+class Marquee:
+    def __init__(self, grid, text, y=0, level=15, gap=4, buffer=None):
+        self.grid = grid
+        self.y = y
+        self.buffer = buffer if buffer is not None else GridBuffer(grid.width, grid.height)
+        self.shown = None
+        self.offset = 0
+        self.set_text(text, level, gap)
+
+    def set_text(self, text, level=15, gap=4):
+        # the strip repeats its start after the gap, so any window of grid
+        # width is a plain slice and scrolling never has to wrap mid-blit
+        sprite = render_text(text, level)
+        self.period = sprite.width + gap
+        repeats = -(-(self.period + self.grid.width) // self.period)
+        self.strip = Sprite([((row + [0] * gap) * repeats)[:self.period + self.grid.width] for row in sprite.levels])
+        self.offset %= self.period
+
+    def step(self, n=1):
+        self.offset = (self.offset + n) % self.period
+        self.render()
+
+    def render(self):
+        self.buffer.blit(self.strip, 0, self.y, src_x=self.offset, width=self.grid.width, transparent=False)
+        if self.shown is None:
+            self.buffer.render(self.grid)
+            self.shown = self.buffer.copy()
+        else:
+            self.buffer.render(self.grid, self.shown)
 
 
 class Page:
+    __slots__ = (
+        'manager', 'event_handler', 'prefix', 'keys', 'width', 'height', '__buffer', '__route'
+    )
+
     def __init__(self):
         self.manager = None
+        self.keys = KeyState()
         self.__buffer = None
+        self.__route = None
 
     @property
     def buffer(self):
@@ -319,9 +1189,11 @@ class Page:
 
     def on_grid_ready(self):
         self.__buffer = GridBuffer(self.width, self.height)
+        Layout.invalidate()
         self.event_handler.on_grid_ready()
 
     def on_grid_key(self, x, y, s):
+        self.keys.update(x, y, s, self.event_handler)
         self.event_handler.on_grid_key(x, y, s)
 
     def on_grid_disconnect(self):
@@ -333,72 +1205,64 @@ class Page:
     def connect(self):
         pass # TODO: not needed?
 
-    def render(self):
-        self.__buffer.render(self.manager)
+    def route(self):
+        if self.__route is None or self.__route.version != Layout.version:
+            targets = [(self.__buffer, 0, 0, 0, 0, self.width, self.height)]
+            if self.is_active():
+                targets.extend(Route.of(self.manager).targets)
+            self.__route = Route(targets)
+        return self.__route
+
+    def render(self, previous=None):
+        self.__buffer.render(Route.of(self.manager), previous)
 
     def led_set(self, x, y, s):
-        self.__buffer.led_set(x, y, s)
-        if self.is_active():
-            self.manager.led_set(x, y, s)
+        self.route().led_set(x, y, s)
 
     def led_all(self, s):
-        self.__buffer.led_all(s)
-        if self.is_active():
-            self.manager.led_all(s)
+        self.route().led_all(s)
 
     def led_map(self, x_offset, y_offset, data):
-        self.__buffer.led_map(x_offset, y_offset, data)
-        if self.is_active():
-            self.manager.led_map(x_offset, y_offset, data)
+        self.route().led_map(x_offset, y_offset, data)
 
     def led_row(self, x_offset, y, data):
-        self.__buffer.led_row(x_offset, y, data)
-        if self.is_active():
-            self.manager.led_row(x_offset, y, data)
+        self.route().led_row(x_offset, y, data)
 
     def led_col(self, x, y_offset, data):
-        self.__buffer.led_col(x, y_offset, data)
-        if self.is_active():
-            self.manager.led_col(x, y_offset, data)
+        self.route().led_col(x, y_offset, data)
 
     def led_intensity(self, i):
         self.manager.led_intensity(i)
 
     def led_level_set(self, x, y, l):
-        self.__buffer.led_level_set(x, y, l)
-        if self.is_active():
-            self.manager.led_level_set(x, y, l)
+        self.route().led_level_set(x, y, l)
 
     def led_level_all(self, l):
-        self.__buffer.led_level_all(l)
-        if self.is_active():
-            self.manager.led_level_all(l)
+        self.route().led_level_all(l)
 
     def led_level_map(self, x_offset, y_offset, data):
-        self.__buffer.led_level_map(x_offset, y_offset, data)
-        if self.is_active():
-            self.manager.led_level_map(x_offset, y_offset, data)
+        self.route().led_level_map(x_offset, y_offset, data)
 
     def led_level_row(self, x_offset, y, data):
-        self.__buffer.led_level_row(x_offset, y, data)
-        if self.is_active():
-            self.manager.led_level_row(x_offset, y, data)
+        self.route().led_level_row(x_offset, y, data)
 
     def led_level_col(self, x, y_offset, data):
-        self.__buffer.led_level_col(x, y_offset, data)
-        if self.is_active():
-            self.manager.led_level_col(x, y_offset, data)
+        self.route().led_level_col(x, y_offset, data)
 
 
 class BasePageManager(GridWrapper):
+    __slots__ = ('pages', 'current_page')
+
     def __init__(self, grid, pages):
         super().__init__(grid)
         self.pages = pages
+        self.current_page = None
         for page in self.pages:
             page.manager = self
         self.set_page(0)
 
     def on_grid_ready(self):
+        Layout.invalidate()
         for page in self.pages:
             page.width = self.grid.width
             page.height = self.grid.height
@@ -409,54 +1273,73 @@ class BasePageManager(GridWrapper):
         for page in self.pages:
             page.disconnect()
 
-    def on_grid_key(self, x, y, s):
-        self.current_page.on_grid_key(x, y, s)
+    def key_target(self, x, y):
+        return self.current_page, x, y
+
+    def set_page(self, index, previous=None):
+        # the device shows the outgoing page, so only the difference from
+        # it needs to be sent
+        if previous is None and self.current_page is not None and self.current_page.buffer:
+            previous = self.current_page.buffer.copy()
 
-    def set_page(self, index):
         self.current_page = self.pages[index]
+        Layout.invalidate()
         if (self.current_page.buffer):
-            self.current_page.render()
+            self.current_page.render(previous)
 
 
 class SumPageManager(BasePageManager):
-    def __init__(self, pages, switch_button=(-1, -1), **kwargs):
-        super().__init__(pages, **kwargs)
+    __slots__ = ('switch_button', 'switch_x', 'switch_y', 'selected_page', 'chooser_frames')
+
+    def __init__(self, grid, pages, switch_button=(-1, -1)):
+        super().__init__(grid, pages)
         self.switch_button = switch_button
+        self.selected_page = 0
+        self.chooser_frames = None
 
-    def ready(self):
-        super().ready()
+    def on_grid_ready(self):
+        super().on_grid_ready()
         switch_x, switch_y = self.switch_button
 
-        self.switch_x = self.width + switch_x if switch_x < 0 else switch_x
-        self.switch_y = self.height + switch_y if switch_y < 0 else switch_y
-
-    def grid_key(self, x, y, s):
-        if not self._presses and \
-           x == self.switch_x and \
-           y == self.switch_y:
-            if s == 1:
-                self.selected_page = self.pages.index(self.current_page)
-                self.switch_page(-1)
-                self.display_chooser()
-            else:
-                self.switch_page(self.selected_page)
-            return
+        self.switch_x = self.grid.width + switch_x if switch_x < 0 else switch_x
+        self.switch_y = self.grid.height + switch_y if switch_y < 0 else switch_y
+
+        self.chooser_frames = [self.__render_chooser(i) for i in range(len(self.pages))]
+
+    def __render_chooser(self, selected):
+        frame = GridBuffer(self.grid.width, self.grid.height)
+        frame.led_row(0, self.grid.height - 1, [1 if i < len(self.pages) else 0 for i in range(self.grid.width)])
+        frame.led_col(selected, 0, [1] * self.grid.height)
+        return frame
+
+    def on_grid_key(self, x, y, s):
+        if x == self.switch_x and y == self.switch_y:
+            if s == 1 and self.current_page is not None and not self.keys.count_held():
+                self.show_chooser()
+                return
+            if s == 0 and self.current_page is None:
+                self.set_page(self.selected_page, self.chooser_frames[self.selected_page].copy())
+                return
         # handle regular buttons
         if self.current_page is None:
-            if x < len(self.pages):
+            if s == 1 and x < len(self.pages) and x != self.selected_page:
+                self.chooser_frames[x].render(Route.of(self), self.chooser_frames[self.selected_page].copy())
                 self.selected_page = x
-                self.display_chooser()
             return
-        super().grid_key(x, y, s)
+        super().on_grid_key(x, y, s)
 
-    def display_chooser(self):
-        self.led_all(0)
-        page_row = [1 if i < len(self.pages) else 0 for i in range(self.width)]
-        self.led_row(0, self.height - 1, page_row)
-        self.led_col(self.selected_page, 0, [1] * self.height)
+    def show_chooser(self):
+        self.selected_page = self.pages.index(self.current_page)
+        previous = self.current_page.buffer.copy()
+
+        self.current_page = None
+        Layout.invalidate()
+        self.chooser_frames[self.selected_page].render(Route.of(self), previous)
 
 
 class SeqPageManager(BasePageManager):
+    __slots__ = ('switch_button', 'switch_x', 'switch_y')
+
     def __init__(self, grid, pages, switch_button=(-1, -1)):
         super().__init__(grid, pages)
         self.switch_button = switch_button
@@ -469,16 +1352,23 @@ class SeqPageManager(BasePageManager):
         self.switch_y = self.grid.height + switch_y if switch_y < 0 else switch_y
 
     def on_grid_key(self, x, y, s):
-        # TODO: bring back presses from pymonome 0.8
-        if x == self.switch_x and y == self.switch_y and s == 1:
+        # the switch button acts as a normal key while others are held
+        if x == self.switch_x and y == self.switch_y and s == 1 and not self.keys.count_held():
             self.set_page((self.pages.index(self.current_page) + 1) % len(self.pages))
         else:
             super().on_grid_key(x, y, s)
 
 class GridSection:
+    __slots__ = (
+        'splitter', 'event_handler', 'prefix', 'keys', 'section_width', 'section_height',
+        'x_offset', 'y_offset', 'width', 'height', '__route'
+    )
+
     def __init__(self, size, offset):
         self.splitter = None
         self.event_handler = None
+        self.keys = KeyState()
+        self.__route = None
 
         self.section_width = size[0]
         self.section_height = size[1]
@@ -494,55 +1384,55 @@ class GridSection:
         self.event_handler.on_grid_ready()
 
     def on_grid_key(self, x, y, s):
+        self.keys.update(x, y, s, self.event_handler)
         self.event_handler.on_grid_key(x, y, s)
 
     def on_grid_disconnect(self):
         self.event_handler.on_grid_disconnect()
 
+    def route(self):
+        if self.__route is None or self.__route.version != Layout.version:
+            self.__route = Route.of(self.splitter).translate(self.x_offset, self.y_offset,
+                self.section_width, self.section_height)
+        return self.__route
+
     def led_set(self, x, y, s):
-        if x < self.section_width and y < self.section_height:
-            self.splitter.led_set(x + self.x_offset, y + self.y_offset, s)
+        self.route().led_set(x, y, s)
 
     def led_all(self, s):
-        # TODO: fix map
-        data = [[s for col in range(8)] for row in range(8)]
-        self.splitter.led_map(self.x_offset, self.y_offset, data)
+        self.route().led_all(s)
 
     def led_map(self, x_offset, y_offset, data):
-        self.splitter.led_map(self.x_offset + x_offset, self.y_offset + y_offset, data)
+        self.route().led_map(x_offset, y_offset, data)
 
     def led_row(self, x_offset, y, data):
-        data = data[:self.section_width]
-        self.splitter.led_row(self.x_offset + x_offset, self.y_offset + y, data)
+        self.route().led_row(x_offset, y, data)
 
     def led_col(self, x, y_offset, data):
-        data = data[:self.section_height]
-        self.splitter.led_col(self.x_offset + x, self.y_offset + y_offset, data)
+        self.route().led_col(x, y_offset, data)
 
     def led_intensity(self, i):
         self.splitter.led_intensity(i)
 
     def led_level_set(self, x, y, l):
-        if x < self.section_width and y < self.section_height:
-            self.splitter.led_level_set(self.x_offset + x, self.y_offset + y, l)
+        self.route().led_level_set(x, y, l)
 
     def led_level_all(self, l):
-        data = [[l for col in range(8)] for row in range(8)]
-        self.splitter.led_map(self.x_offset, self.y_offset, data)
+        self.route().led_level_all(l)
 
     def led_level_map(self, x_offset, y_offset, data):
-        self.splitter.led_level_map(self.x_offset + x_offset, self.y_offset + y_offset, data)
+        self.route().led_level_map(x_offset, y_offset, data)
 
     def led_level_row(self, x_offset, y, data):
-        data = data[:self.section_width]
-        self.splitter.led_level_row(self.x_offset + x_offset, self.y_offset + y, data)
+        self.route().led_level_row(x_offset, y, data)
 
     def led_level_col(self, x, y_offset, data):
-        data = data[:self.section_height]
-        self.splitter.led_level_col(self.x_offset + x, self.y_offset + y_offset, data)
+        self.route().led_level_col(x, y_offset, data)
 
 
 class Splitter(GridWrapper):
+    __slots__ = ('sections',)
+
     def __init__(self, grid, sections):
         super().__init__(grid)
         self.sections = sections
@@ -550,6 +1440,7 @@ class Splitter(GridWrapper):
             section.splitter = self
 
     def on_grid_ready(self):
+        Layout.invalidate()
         for section in self.sections:
             section.on_grid_ready()
 
@@ -557,14 +1448,563 @@ class Splitter(GridWrapper):
         for section in self.sections:
             section.on_grid_disconnect()
 
-    def on_grid_key(self, x, y, s):
+    def key_target(self, x, y):
         for section in self.sections:
             if section.x_offset <= x < section.x_offset + section.section_width and \
                section.y_offset <= y < section.y_offset + section.section_height:
-                section.on_grid_key(x - section.x_offset, y - section.y_offset, s)
+                return section, x - section.x_offset, y - section.y_offset
+        return None, x, y
+
+
+class ThreadedGrid(GridWrapper):
+    # LED writes from any thread go into a back buffer as plain list stores,
+    # which are atomic under the GIL. commit() publishes a finished copy by
+    # swapping a single reference, and the loop thread diffs the latest
+    # published frame against what the device shows once per tick, so a
+    # multi-cell update is never sent half-applied
+    def __init__(self, grid, fps=60, loop=None, queue_keys=False, key_queue_size=256):
+        super().__init__(grid)
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.interval = 1 / fps
+
+        self.back = None
+        self.front = None
+        self.sent = None
+        self.key_events = queue.Queue(key_queue_size) if queue_keys else None
+        self.ready = threading.Event()
+        self.__rendered = None
+        self.__tick_handle = None
+
+    def on_grid_ready(self):
+        self.width = self.grid.width
+        self.height = self.grid.height
+        self.back = GridBuffer(self.width, self.height)
+        self.front = self.back.copy()
+        self.sent = GridBuffer(self.width, self.height)
+        self.__rendered = self.front
+        self.grid.led_level_all(0)
+
+        if self.__tick_handle is not None:
+            self.__tick_handle.cancel()
+        self.__tick_handle = self.loop.call_later(self.interval, self.__tick)
+        self.ready.set()
+        if self.event_handler is not None:
+            self.event_handler.on_grid_ready()
+
+    def on_grid_key(self, x, y, s):
+        if self.key_events is not None:
+            self.__queue_key((x, y, s))
+        super().on_grid_key(x, y, s)
+
+    def on_grid_disconnect(self):
+        if self.__tick_handle is not None:
+            self.__tick_handle.cancel()
+            self.__tick_handle = None
+        self.ready.clear()
+        if self.key_events is not None:
+            self.__queue_key(None)
+        if self.event_handler is not None:
+            self.event_handler.on_grid_disconnect()
+
+    def __queue_key(self, event):
+        # drop the oldest event rather than grow without bound
+        while True:
+            try:
+                self.key_events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self.key_events.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def commit(self):
+        self.front = self.back.copy()
+
+    def route(self):
+        # writes from nested pages and sections must land in the frame too
+        return Route([(self, 0, 0, 0, 0, self.width, self.height)])
+
+    def __tick(self):
+        frame = self.front
+        if frame is not self.__rendered:
+            self.__rendered = frame
+            frame.render(self.grid, self.sent)
+        self.__tick_handle = self.loop.call_later(self.interval, self.__tick)
+
+    def led_set(self, x, y, s):
+        self.back.led_set(x, y, s)
+
+    def led_all(self, s):
+        self.back.led_all(s)
+
+    def led_map(self, x_offset, y_offset, data):
+        self.back.led_map(x_offset, y_offset, data)
+
+    def led_row(self, x_offset, y, data):
+        self.back.led_row(x_offset, y, data)
+
+    def led_col(self, x, y_offset, data):
+        self.back.led_col(x, y_offset, data)
+
+    def led_intensity(self, i):
+        self.loop.call_soon_threadsafe(self.grid.led_intensity, i)
+
+    def led_level_set(self, x, y, l):
+        self.back.led_level_set(x, y, l)
+
+    def led_level_all(self, l):
+        self.back.led_level_all(l)
+
+    def led_level_map(self, x_offset, y_offset, data):
+        self.back.led_level_map(x_offset, y_offset, data)
+
+    def led_level_row(self, x_offset, y, data):
+        self.back.led_level_row(x_offset, y, data)
+
+    def led_level_col(self, x, y_offset, data):
+        self.back.led_level_col(x, y_offset, data)
+
+    def tilt_set(self, n, s):
+        self.loop.call_soon_threadsafe(self.grid.tilt_set, n, s)
+
+
+class Transport:
+    def __init__(self, bpm=120, steps_per_beat=4, swing=0.0, lookahead=0.01, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.event_handler = None
+
+        self.__bpm = bpm
+        self.steps_per_beat = steps_per_beat
+        self.swing = swing
+        self.lookahead = lookahead
+
+        self.step = 0
+        self.origin = None
+        self.origin_step = 0
+        self.scheduled = []
+        self.__counter = itertools.count()
+        self.__handle = None
+        self.__wake_time = None
+        self.__generation = 0
+        self.reset_jitter()
+
+    @property
+    def bpm(self):
+        return self.__bpm
+
+    @bpm.setter
+    def bpm(self, bpm):
+        # rebase on the next step so tempo changes don't move past steps;
+        # the unswung time, since step_time adds swing on top of the origin
+        if self.origin is not None:
+            self.origin += (self.step - self.origin_step) * self.step_length
+            self.origin_step = self.step
+        self.__bpm = bpm
+
+    @property
+    def step_length(self):
+        return 60.0 / self.__bpm / self.steps_per_beat
+
+    @property
+    def running(self):
+        return self.__handle is not None
+
+    def step_time(self, step):
+        # absolute loop time of a step, odd steps delayed by swing
+        t = self.origin + (step - self.origin_step) * self.step_length
+        if step % 2:
+            t += self.swing * self.step_length
+        return t
+
+    def start(self, step=0):
+        if self.__handle is not None:
+            self.__handle.cancel()
+        self.__generation += 1
+        self.step = step
+        self.origin = self.loop.time()
+        self.origin_step = step
+        self.__schedule_wakeup()
+
+    def stop(self):
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__handle = None
+        self.__generation += 1
+        self.origin = None
+
+    def schedule(self, step, callback, *args):
+        heapq.heappush(self.scheduled, (step, next(self.__counter), callback, args))
+
+    def __schedule_wakeup(self):
+        self.__wake_time = self.step_time(self.step) - self.lookahead
+        self.__handle = self.loop.call_at(self.__wake_time, self.__tick)
+
+    def __tick(self):
+        now = self.loop.time()
+        late = now - self.__wake_time
+        self.jitter_count += 1
+        self.jitter_total += late
+        self.jitter_max = max(self.jitter_max, late)
+
+        # every step inside the lookahead window is due, including any
+        # missed by a late wakeup; handlers get the exact step time. A
+        # callback or handler may call start() or stop(), which set the step
+        # and wakeup themselves, so the loop bails out as soon as that happens
+        generation = self.__generation
+        while self.step_time(self.step) <= now + self.lookahead:
+            when = self.step_time(self.step)
+            if when < now:
+                self.late_steps += 1
+
+            while self.scheduled and self.scheduled[0][0] <= self.step:
+                step, n, callback, args = heapq.heappop(self.scheduled)
+                callback(*args)
+                if self.__generation != generation:
+                    return
+            if self.event_handler is not None:
+                self.event_handler.on_transport_step(self.step, when)
+                if self.__generation != generation:
+                    return
+            self.step += 1
+
+        self.__schedule_wakeup()
+
+    def reset_jitter(self):
+        self.jitter_count = 0
+        self.jitter_total = 0.0
+        self.jitter_max = 0.0
+        self.late_steps = 0
+
+    def jitter_stats(self):
+        return {
+            'count': self.jitter_count,
+            'mean': self.jitter_total / self.jitter_count if self.jitter_count else 0.0,
+            'max': self.jitter_max,
+            'late_steps': self.late_steps,
+        }
+
+
+class Playhead:
+    def __init__(self, grid, pattern, level=15):
+        self.grid = grid
+        self.pattern = pattern
+        self.level = level
+        self.x = None
+
+        # levels under the playhead, looked up per cell
+        self.table = [max(l, level) for l in range(16)]
+        self.overlays = [None] * pattern.width
+        self.shown = [None] * pattern.width
+
+    def pattern_changed(self, x=None):
+        for col in range(self.pattern.width) if x is None else [x]:
+            self.overlays[col] = None
+            if col != self.x:
+                self.__show(col, self.__column(col))
+        if self.x is not None and (x is None or x == self.x):
+            self.__show(self.x, self.__overlay(self.x))
+
+    def move(self, x):
+        if x == self.x:
+            return
+        if self.x is not None:
+            self.__show(self.x, self.__column(self.x))
+        self.x = x
+        if x is not None:
+            self.__show(x, self.__overlay(x))
+
+    def __column(self, x):
+        return [row[x] for row in self.pattern.levels]
+
+    def __overlay(self, x):
+        if self.overlays[x] is None:
+            self.overlays[x] = [self.table[l] for l in self.__column(x)]
+        return self.overlays[x]
+
+    def __show(self, x, column):
+        # send a column only when it differs from what the device shows
+        if self.shown[x] != column:
+            self.shown[x] = column
+            self.grid.led_level_col(x, 0, column)
+
+
+def write_frames(path, frames):
+    # frames are GridBuffers or lists of level rows, stored as one byte per cell
+    with open(path, 'wb') as f:
+        for frame in frames:
+            levels = frame.levels if isinstance(frame, GridBuffer) else frame
+            f.write(bytes(itertools.chain(*levels)))
+
+
+class FramePlayer:
+    def __init__(self, grid, path, fps=30, loop_playback=True, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.grid = grid
+        self.width = grid.width
+        self.height = grid.height
+        self.frame_size = self.width * self.height
+
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.length = len(self.data) // self.frame_size
+        if self.length == 0 or len(self.data) % self.frame_size:
+            self.data.close()
+            raise ValueError('{} does not hold whole {}x{} frames'.format(path, self.width, self.height))
+
+        self.fps = fps
+        self.loop_playback = loop_playback
+        self.position = 0
+        self.shown = None
+
+        self.__rate = 1.0
+        self.__origin = None
+        self.__origin_frame = 0
+        self.__handle = None
+
+    @property
+    def rate(self):
+        return self.__rate
+
+    @rate.setter
+    def rate(self, rate):
+        if rate < 0:
+            raise ValueError("rate must not be negative")
+        self.__rebase()
+        self.__rate = rate
+        # a rate of 0 pauses in place; any other rate resumes from there
+        if self.__origin is not None:
+            self.__cancel()
+            if rate:
+                self.__tick()
+
+    @property
+    def playing(self):
+        return self.__origin is not None
+
+    def play(self):
+        if self.__origin is None:
+            self.__origin = self.loop.time()
+            self.__origin_frame = self.position
+            if self.__rate:
+                self.__tick()
+
+    def stop(self):
+        self.__cancel()
+        self.__origin = None
+
+    def seek(self, position):
+        self.position = position % self.length
+        self.__rebase()
+        self.show(self.position)
+
+    def close(self):
+        self.stop()
+        self.data.close()
+
+    def __cancel(self):
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__handle = None
+
+    def __rebase(self):
+        if self.__origin is not None:
+            self.__origin = self.loop.time()
+            self.__origin_frame = self.position
+
+    def __tick(self):
+        # pick the frame that is due now, skipping any a late wakeup missed
+        elapsed = (self.loop.time() - self.__origin) * self.fps * self.__rate
+        position = self.__origin_frame + int(elapsed)
+        if position >= self.length:
+            if not self.loop_playback:
+                self.show(self.length - 1)
+                self.__handle = None
+                self.__origin = None
+                return
+            position %= self.length
+
+        if position != self.position or self.shown is None:
+            self.position = position
+            self.show(position)
+
+        next_time = self.__origin + (int(elapsed) + 1) / (self.fps * self.__rate)
+        self.__handle = self.loop.call_at(next_time, self.__tick)
+
+    def show(self, position):
+        offset = position * self.frame_size
+        frame = self.data[offset:offset + self.frame_size]
+        shown = self.shown
+        width = self.width
+
+        for y_offset in range(0, self.height, 8):
+            for x_offset in range(0, width, 8):
+                rows = [y * width + x_offset for y in range(y_offset, y_offset + 8)]
+                if shown is not None and all(frame[i:i + 8] == shown[i:i + 8] for i in rows):
+                    continue
+
+                changed = [] if shown is None else \
+                    [(i + x) for i in rows for x in range(8) if frame[i + x] != shown[i + x]]
+                if len(changed) == 1:
+                    i = changed[0]
+                    self.grid.led_level_set(i % width, i // width, frame[i])
+                else:
+                    self.grid.led_level_map(x_offset, y_offset, [list(frame[i:i + 8]) for i in rows])
+        self.shown = frame
+
+
+class HeadlessGrid:
+    # a grid with no socket of its own: levels live in a slice of the mux's
+    # shared bytearray and packets, if any, go through the mux's transport
+    __slots__ = (
+        'mux', 'index', 'offset', 'prefix', 'id', 'width', 'height', 'varibright', 'state',
+        'intensity', 'keys', 'event_handler'
+    )
+
+    def __init__(self, mux, index, offset, width, height, id):
+        self.mux = mux
+        self.index = index
+        self.offset = offset
+        self.prefix = 'monome'
+        self.id = id
+        self.width = width
+        self.height = height
+        self.varibright = True
+        self.state = DISCONNECTED
+        self.intensity = 15
+        self.keys = KeyState()
+        self.event_handler = None
+
+    def connect(self):
+        if self.state == DISCONNECTED:
+            self.state = READY
+            if self.event_handler is not None:
+                self.event_handler.on_grid_ready()
+
+    def disconnect(self):
+        self.state = DISCONNECTED
+        if self.event_handler is not None:
+            self.event_handler.on_grid_disconnect()
 
+    def key(self, x, y, s):
+        if self.event_handler is not None:
+            self.keys.update(x, y, s, self.event_handler)
+            self.event_handler.on_grid_key(x, y, s)
+
+    def level(self, x, y):
+        return self.mux.levels[self.offset + y * self.width + x]
+
+    @property
+    def levels(self):
+        # a snapshot: a live view would pin the shared bytearray and stop the
+        # mux from growing it for the next grid
+        return bytes(self.mux.levels[self.offset:self.offset + self.width * self.height])
+
+    def led_set(self, x, y, s):
+        self.led_level_set(x, y, s * 15)
+
+    def led_all(self, s):
+        self.led_level_all(s * 15)
 
-class SerialOsc(aiosc.OSCProtocol):
+    def led_map(self, x_offset, y_offset, data):
+        self.led_level_map(x_offset, y_offset, [[s * 15 for s in row] for row in data])
+
+    def led_row(self, x_offset, y, data):
+        self.led_level_row(x_offset, y, [s * 15 for s in data])
+
+    def led_col(self, x, y_offset, data):
+        self.led_level_col(x, y_offset, [s * 15 for s in data])
+
+    def led_intensity(self, i):
+        self.intensity = i
+        self.mux.forward(self, 'intensity', i)
+
+    def led_level_set(self, x, y, l):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.mux.levels[self.offset + y * self.width + x] = l
+            self.mux.forward(self, 'level/set', x, y, l)
+
+    def led_level_all(self, l):
+        size = self.width * self.height
+        self.mux.levels[self.offset:self.offset + size] = bytes([l]) * size
+        self.mux.forward(self, 'level/all', l)
+
+    def led_level_map(self, x_offset, y_offset, data):
+        for r, row in enumerate(data):
+            self.__write_row(x_offset, y_offset + r, row)
+        self.mux.forward(self, 'level/map', x_offset, y_offset, *itertools.chain(*data))
+
+    def led_level_row(self, x_offset, y, data):
+        self.__write_row(x_offset, y, data)
+        self.mux.forward(self, 'level/row', x_offset, y, *data)
+
+    def led_level_col(self, x, y_offset, data):
+        if 0 <= x < self.width and y_offset < self.height:
+            data = data[:self.height - y_offset]
+            start = self.offset + y_offset * self.width + x
+            self.mux.levels[start:start + len(data) * self.width:self.width] = bytes(data)
+        self.mux.forward(self, 'level/col', x, y_offset, *data)
+
+    def __write_row(self, x_offset, y, data):
+        if 0 <= y < self.height and x_offset < self.width:
+            data = data[:self.width - x_offset]
+            start = self.offset + y * self.width + x_offset
+            self.mux.levels[start:start + len(data)] = bytes(data)
+
+    def tilt_set(self, n, s):
+        pass
+
+
+class GridMux(RecordableProtocol):
+    # one endpoint for any number of headless grids; on the wire grid n uses
+    # the prefix /n, so a stand-in can drive all of them over one socket
+    def __init__(self, remote_addr=None):
+        super().__init__(handlers={
+            '/*/grid/key': self.__grid_key,
+        })
+        self.remote_addr = remote_addr
+        self.grids = []
+        self.levels = bytearray()
+
+    @classmethod
+    async def create(cls, loop=None, local_addr=('127.0.0.1', 0), remote_addr=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+
+        transport, protocol = await loop.create_datagram_endpoint(lambda: cls(remote_addr=remote_addr),
+            local_addr=local_addr)
+        return protocol
+
+    def create_grid(self, width=16, height=8, id=None):
+        index = len(self.grids)
+        if id is None:
+            id = 'm{}'.format(index)
+
+        grid = HeadlessGrid(self, index, len(self.levels), width, height, id)
+        self.levels.extend(bytes(width * height))
+        self.grids.append(grid)
+        return grid
+
+    def forward(self, grid, command, *args):
+        if self.transport is not None and self.remote_addr is not None:
+            self.send('/{}/grid/led/{}'.format(grid.index, command), *args, addr=self.remote_addr)
+
+    def __grid_key(self, addr, path, x, y, s):
+        index = path.split('/')[1]
+        if index.isdigit() and int(index) < len(self.grids):
+            self.grids[int(index)].key(x, y, s)
+
+
+class SerialOsc(RecordableProtocol):
     def __init__(self, loop=None, autoconnect_app=None):
         super().__init__(handlers={
             '/serialosc/device': self.__on_serialosc_device,
@@ -607,7 +2047,7 @@ class SerialOsc(aiosc.OSCProtocol):
 
     def on_device_added(self, id, type, port):
         if self.autoconnect_app is not None:
-            asyncio.async(self.autoconnect(self.autoconnect_app, port))
+            asyncio.ensure_future(self.autoconnect(self.autoconnect_app, port))
 
     def on_device_removed(self, id, type, port):
         pass
@@ -628,11 +2068,13 @@ class App:
         self.grid = grid
         self.grid.event_handler = self
         self.grid.prefix = self.prefix
+        Layout.invalidate()
         self.grid.connect()
 
     def detach(self):
         self.grid.event_handler = None
         self.grid = None
+        Layout.invalidate()
 
     def on_grid_ready(self):
         pass
@@ -642,3 +2084,287 @@ class App:
 
     def on_grid_key(self, x, y, s):
         pass
+
+
+class SinkTransport:
+    # stands in for a datagram transport and only counts what is sent
+    def __init__(self, recorder=None):
+        self.recorder = recorder
+        self.messages = 0
+        self.bytes = 0
+        self.closed = False
+
+    def get_extra_info(self, name, default=None):
+        if name == 'sockname':
+            return ('127.0.0.1', 0)
+        return default
+
+    def sendto(self, data, addr=None):
+        self.messages += 1
+        self.bytes += len(data)
+        if self.recorder is not None:
+            self.recorder.write(RECORD_OUT, data)
+
+    def close(self):
+        self.closed = True
+
+
+class Replay:
+    def __init__(self, log, app, speed=1.0, recorder=None, loop=None):
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+        self.log = log
+        self.app = app
+        self.speed = speed
+
+        self.grid = Grid()
+        self.transport = SinkTransport(recorder)
+        self.grid.connection_made(self.transport)
+
+    async def run(self):
+        # feed recorded incoming packets to the app; speed=None replays as
+        # fast as possible
+        self.app.attach(self.grid)
+        start = self.loop.time()
+        for t, direction, data in self.log:
+            if direction != RECORD_IN:
+                continue
+            if self.speed:
+                delay = start + t / self.speed - self.loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            self.grid.datagram_received(bytes(data), ('127.0.0.1', 0))
+        return self.transport
+
+
+class VirtualGrid(RecordableProtocol):
+    def __init__(self, broker, size=None, offset=(0, 0)):
+        self.broker = broker
+        self.number = None
+        self.size = size
+        self.x_offset, self.y_offset = offset
+        self.width = None
+        self.height = None
+        self.buffer = None
+
+        self.prefix = 'monome'
+        self.client_host = '127.0.0.1'
+        self.client_port = None
+        self.pending_info = []
+
+        super().__init__(handlers={
+            '/sys/host': self.__sys_host,
+            '/sys/port': self.__sys_port,
+            '/sys/prefix': self.__sys_prefix,
+            '/sys/info': self.__sys_info,
+            '/sys/info/*': self.__sys_info,
+            '/*/grid/led/*': self.__grid_led,
+            '/*/grid/led/level/*': self.__grid_led,
+        })
+
+    def connection_made(self, transport):
+        super().connection_made(transport)
+        self.host, self.port = transport.get_extra_info('sockname')
+
+    @property
+    def id(self):
+        return '{}{}'.format(self.broker.grid.id, self.number)
+
+    def on_broker_ready(self, width, height):
+        self.width, self.height = self.size if self.size is not None else (width, height)
+        self.buffer = GridBuffer(self.width, self.height)
+
+        for addr, path, *args in self.pending_info:
+            self.__sys_info(addr, path, *args)
+        self.pending_info = []
+
+    def on_broker_disconnect(self):
+        if self.client_port is not None:
+            self.send('/sys/disconnect', addr=(self.client_host, self.client_port))
+        self.close()
+
+    def key(self, x, y, s):
+        if self.client_port is not None:
+            self.send('/{}/grid/key'.format(self.prefix), x, y, s, addr=(self.client_host, self.client_port))
+
+    def __sys_host(self, addr, path, host):
+        self.client_host = host
+
+    def __sys_port(self, addr, path, port):
+        self.client_port = port
+
+    def __sys_prefix(self, addr, path, prefix):
+        self.prefix = prefix.strip('/')
+
+    def __sys_info(self, addr, path, *args):
+        if self.buffer is None:
+            # device size isn't known until the broker is ready
+            self.pending_info.append((addr, path) + args)
+            return
+
+        if len(args) == 2:
+            addr = (args[0], args[1])
+        elif len(args) == 1:
+            addr = ('127.0.0.1', args[0])
+
+        replies = {
+            'id': (self.id,),
+            'size': (self.width, self.height),
+            'host': (self.client_host,),
+            'port': (self.client_port if self.client_port is not None else addr[1],),
+            'prefix': ('/' + self.prefix,),
+            'rotation': (0,),
+        }
+        keys = replies.keys() if path == '/sys/info' else [path[len('/sys/info/'):]]
+        for key in keys:
+            if key in replies:
+                self.send('/sys/' + key, *replies[key], addr=addr)
+
+    def __grid_led(self, addr, path, *args):
+        prefix = '/{}/grid/led/'.format(self.prefix)
+        if self.buffer is None or not path.startswith(prefix):
+            return
+
+        command = path[len(prefix):]
+        if command == 'set':
+            self.buffer.led_set(*args)
+        elif command == 'all':
+            self.buffer.led_all(*args)
+        elif command == 'map':
+            self.buffer.led_map(args[0], args[1], [unpack_row(b) for b in args[2:10]])
+        elif command == 'row':
+            self.buffer.led_row(args[0], args[1], list(itertools.chain(*[unpack_row(b) for b in args[2:]])))
+        elif command == 'col':
+            self.buffer.led_col(args[0], args[1], list(itertools.chain(*[unpack_row(b) for b in args[2:]])))
+        elif command == 'intensity':
+            self.broker.led_intensity(*args)
+            return
+        elif command == 'level/set':
+            self.buffer.led_level_set(*args)
+        elif command == 'level/all':
+            self.buffer.led_level_all(*args)
+        elif command == 'level/map':
+            self.buffer.led_level_map(args[0], args[1], [list(args[2 + i * 8:10 + i * 8]) for i in range(8)])
+        elif command == 'level/row':
+            self.buffer.led_level_row(args[0], args[1], list(args[2:]))
+        elif command == 'level/col':
+            self.buffer.led_level_col(args[0], args[1], list(args[2:]))
+        else:
+            return
+
+        self.broker.mark_dirty(self)
+
+
+class GridBroker(App):
+    def __init__(self, prefix='/monome', loop=None):
+        super().__init__(prefix)
+
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.loop = loop
+
+        self.clients = []
+        self.client_count = 0
+        self.owners = None
+        self.spans = {}
+        self.frame = None
+        self.sent = None
+        self.dirty = set()
+        self.flush_handle = None
+
+    async def add_client(self, size=None, offset=(0, 0), port=0):
+        transport, client = await self.loop.create_datagram_endpoint(lambda: VirtualGrid(self, size, offset),
+            local_addr=('127.0.0.1', port))
+        # numbered once, so the id a client sees doesn't follow the stacking order
+        client.number = self.client_count
+        self.client_count += 1
+        self.clients.append(client)
+
+        if self.frame is not None:
+            client.on_broker_ready(self.grid.width, self.grid.height)
+            self.__update_layout()
+        return client
+
+    def remove_client(self, client):
+        self.clients.remove(client)
+        client.close()
+        if self.frame is not None:
+            self.__update_layout()
+
+    def raise_client(self, client):
+        # clients later in the list are on top, so a full-size client raised
+        # this way acts as the current page
+        self.clients.remove(client)
+        self.clients.append(client)
+        if self.frame is not None:
+            self.__update_layout()
+
+    def on_grid_ready(self):
+        self.frame = GridBuffer(self.grid.width, self.grid.height)
+        self.sent = GridBuffer(self.grid.width, self.grid.height)
+        self.grid.led_level_all(0)
+
+        for client in self.clients:
+            client.on_broker_ready(self.grid.width, self.grid.height)
+        self.__update_layout()
+
+    def on_grid_disconnect(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        for client in self.clients:
+            client.on_broker_disconnect()
+        self.clients = []
+        self.frame = None
+        super().on_grid_disconnect()
+
+    def on_grid_key(self, x, y, s):
+        if self.owners is None:
+            return
+        client = self.owners[y][x]
+        if client is not None:
+            client.key(x - client.x_offset, y - client.y_offset, s)
+
+    def led_intensity(self, i):
+        if self.grid is not None:
+            self.grid.led_intensity(i)
+
+    def mark_dirty(self, client):
+        if self.frame is None:
+            return
+        self.dirty.add(client)
+        if self.flush_handle is None:
+            self.flush_handle = self.loop.call_soon(self.__flush)
+
+    def __update_layout(self):
+        width, height = self.grid.width, self.grid.height
+        self.owners = [[None for col in range(width)] for row in range(height)]
+
+        for client in self.clients:
+            for y in range(max(client.y_offset, 0), min(client.y_offset + client.height, height)):
+                for x in range(max(client.x_offset, 0), min(client.x_offset + client.width, width)):
+                    self.owners[y][x] = client
+
+        # collapse the cell table into per-client row spans for compositing
+        self.spans = {client: [] for client in self.clients}
+        for y, row in enumerate(self.owners):
+            for client, cells in itertools.groupby(range(width), key=lambda x: row[x]):
+                if client is not None:
+                    cells = list(cells)
+                    self.spans[client].append((y, cells[0], cells[-1] + 1))
+
+        self.frame.led_level_all(0)
+        for client in self.clients:
+            self.mark_dirty(client)
+
+    def __flush(self):
+        self.flush_handle = None
+        for client in self.dirty:
+            levels = client.buffer.levels
+            for y, x0, x1 in self.spans.get(client, []):
+                self.frame.levels[y][x0:x1] = levels[y - client.y_offset][x0 - client.x_offset:x1 - client.x_offset]
+        self.dirty.clear()
+
+        if self.grid is not None:
+            self.frame.render(self.grid, self.sent)